@@ -1,14 +1,17 @@
 import os
 import logging
 import asyncio
-import requests
-import json
-import re
+import httpx
+import orjson
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from typing import Dict, List, Optional
 
 from fastapi import FastAPI
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError
 
 from google.adk.agents import Agent
 from google.adk.runners import Runner
@@ -19,12 +22,33 @@ from google.genai import types
 
 from config import config
 
+# Export the API key for the Gemini client once at import rather than per request
+_API_KEY_CONFIGURED = bool(config.GOOGLE_API_KEY) and config.GOOGLE_API_KEY != "YOUR_API_KEY"
+if _API_KEY_CONFIGURED:
+    os.environ["GOOGLE_API_KEY"] = config.GOOGLE_API_KEY
+
+# Root handler at its default WARNING level keeps third-party loggers quiet, while
+# this module's records are emitted down to LOG_LEVEL
+logging.basicConfig(format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
+logger.setLevel(os.environ.get("LOG_LEVEL", "INFO").upper())
+
 # Ignore warnings from ADK and Gemini APIs
 logging.getLogger("google.adk.runners").setLevel(logging.ERROR)
 logging.getLogger("google_genai.types").setLevel(logging.ERROR)
 
+# Stream every ADK event to the client log console only when explicitly enabled;
+# this is the default for the /chat `debug` query parameter
+DEBUG_EVENTS = os.environ.get("ADK_DEBUG_EVENTS") == "1"
+
 # --- FastAPI App ---
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # Release pooled vector-search connections on shutdown
+    await _HTTP.aclose()
+
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -47,49 +71,233 @@ class ProductItem(BaseModel):
 class ShoppingResult(BaseModel):
     items: List[ProductItem]
 
+# Validates a whole result list in one pydantic-core call
+_ITEMS_ADAPTER = TypeAdapter(List[ProductItem])
+
+_EMPTY_RESULT = ShoppingResult(items=[])
+
 # --- Vector Search Tool ---
-def call_vector_search(url, query, rows=None):
-    headers = {'Content-Type': 'application/json'}
-    payload = {
-        "query": query,
-        "rows": rows,
-        "dataset_id": "mercari3m_mm",
-        "use_dense": True,
-        "use_sparse": True,
-        "rrf_alpha": 0.5,
-        "use_rerank": True,
-    }
+# Shared client so concurrent searches reuse pooled connections; over HTTP/2 they are
+# multiplexed on a single connection
+_HTTP = httpx.AsyncClient(
+    transport=httpx.AsyncHTTPTransport(
+        http2=True,
+        retries=2,
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=10),
+    ),
+    timeout=httpx.Timeout(30.0, connect=3.0),
+)
+
+# Process-wide cap on in-flight searches so one broad request cannot starve others,
+# and a per-search deadline so one stuck query cannot stall the whole tool call
+_SEARCH_SEMAPHORE = asyncio.Semaphore(int(os.environ.get("VS_CONCURRENCY", "8")))
+_SEARCH_TIMEOUT = 20
+
+# Exact-match LRU of search responses keyed by (url, normalized query, rows)
+_SEARCH_CACHE: "OrderedDict[tuple, dict]" = OrderedDict()
+_SEARCH_CACHE_SIZE = 1024
+
+# Searches currently in flight, by the same key, as [task, waiter count]; identical
+# concurrent calls share one task, which is cancelled once nobody is waiting on it
+_INFLIGHT: Dict[tuple, list] = {}
+
+# Queue of the /chat stream currently running the agent, if any. find_shopping_items
+# pushes ("products", items) onto it as each query returns so the client can render
+# results before the agent has written its answer.
+_PRODUCT_SINK: ContextVar[Optional[asyncio.Queue]] = ContextVar("_PRODUCT_SINK", default=None)
+
+# Search settings shared by every vector-search request; only query and rows vary
+_PAYLOAD_TEMPLATE = {
+    "dataset_id": "mercari3m_mm",
+    "use_dense": True,
+    "use_sparse": True,
+    "rrf_alpha": 0.5,
+    "use_rerank": True,
+}
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+# Upper bound on products handed back to the agent per tool call
+MAX_ITEMS = 50
+# Upper bound on rows requested from the backend per query
+MAX_ROWS_PER_QUERY = 25
+
+def _normalize_query(query: str) -> str:
+    """
+    Canonical form of a search query: lowercase with whitespace collapsed. Used
+    for the cache/single-flight key and for pruning the tool's query list.
+    """
+    return " ".join(query.split()).lower()
+
+async def call_vector_search(url, query, rows=None):
+    query = _normalize_query(query)
+    key = (url, query, rows)
+    cached = _SEARCH_CACHE.get(key)
+    if cached is not None:
+        _SEARCH_CACHE.move_to_end(key)
+        return cached
+
+    entry = _INFLIGHT.get(key)
+    if entry is None:
+        task = asyncio.ensure_future(_fetch_vector_search(url, query, rows, key))
+        entry = _INFLIGHT[key] = [task, 0]
+
+        def forget(done_task):
+            current = _INFLIGHT.get(key)
+            if current is not None and current[0] is done_task:
+                del _INFLIGHT[key]
+
+        task.add_done_callback(forget)
+    task = entry[0]
+    entry[1] += 1
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
+        # Shielded so a cancelled caller does not cancel the search for the others
+        return await asyncio.shield(task)
+    finally:
+        entry[1] -= 1
+        # The last caller gave up: stop the request and free its semaphore slot
+        if entry[1] == 0 and not task.done():
+            if _INFLIGHT.get(key) is entry:
+                del _INFLIGHT[key]
+            task.cancel()
+
+async def _fetch_vector_search(url, query, rows, key):
+    payload = {**_PAYLOAD_TEMPLATE, "query": query, "rows": rows}
+    try:
+        async with _SEARCH_SEMAPHORE:
+            response = await asyncio.wait_for(
+                _HTTP.post(
+                    url,
+                    content=orjson.dumps(payload),
+                    headers=_JSON_HEADERS,
+                ),
+                timeout=_SEARCH_TIMEOUT,
+            )
         response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Error calling the API: {e}")
+        result = orjson.loads(response.content)
+    except (httpx.HTTPError, orjson.JSONDecodeError, asyncio.TimeoutError) as e:
+        logger.error("Error calling the API: %r", e)
+        return None
+    # Anything but {"items": [...]} is treated like a failed call and never cached
+    if not isinstance(result, dict) or not isinstance(result.get("items"), list):
+        logger.error("Unexpected response from the API for %r: %.200r", query, result)
         return None
 
-def find_shopping_items(queries: list[str], rows_per_query: Optional[int] = None) -> ShoppingResult:
+    _SEARCH_CACHE[key] = result
+    if len(_SEARCH_CACHE) > _SEARCH_CACHE_SIZE:
+        _SEARCH_CACHE.popitem(last=False)
+    return result
+
+def _contains_words(words: tuple, other: tuple) -> bool:
+    """
+    True if the word sequence `words` appears contiguously inside `other`.
+    """
+    n = len(words)
+    return any(other[i:i + n] == words for i in range(len(other) - n + 1))
+
+def _normalize_queries(queries: list[str]) -> list[str]:
+    """
+    Normalizes queries, drops duplicates, and drops queries whose words appear as
+    a contiguous run of words in a longer one ("mugs" when "coffee mugs" is also
+    requested, but not "hat" next to "chat").
+    """
+    normalized = [tuple(q.split()) for q in dict.fromkeys(_normalize_query(q) for q in queries)]
+    return [
+        " ".join(words) for words in normalized
+        if words and not any(
+            len(other) > len(words) and _contains_words(words, other)
+            for other in normalized
+        )
+    ]
+
+# Placeholder for a query whose search has not finished yet
+_PENDING = object()
+
+def _merge_items(results: list) -> list[dict]:
+    """
+    Merges per-query search results in query order, keeping the first occurrence
+    of each product id, up to MAX_ITEMS. Stops at the first unfinished query so
+    the merged prefix never changes once computed.
+    """
+    seen = {}
+    for result in results:
+        if result is _PENDING:
+            break
+        if not result:
+            continue
+        for item in result.get("items", ()):
+            seen.setdefault(item["id"], item)
+            if len(seen) >= MAX_ITEMS:
+                return list(seen.values())
+    return list(seen.values())
+
+async def find_shopping_items(queries: list[str], rows_per_query: Optional[int] = None) -> ShoppingResult:
     """
     Finds shopping items from the vector search API based on a list of queries.
     Returns a list of products with their details.
     :param queries: A list of search terms.
     :param rows_per_query: The number of items to retrieve for each query.
     """
-    # Set a default value inside the function if not provided
-    if rows_per_query is None:
-        rows_per_query = 10
-
-    all_items = []
-    for query in queries:
-        result = call_vector_search(
-            url=config.VECTOR_SEARCH_URL,
-            query=query,
-            rows=rows_per_query,
-        )
-        if result and "items" in result:
-            all_items.extend(result["items"])
-    
-    # Ensure the returned data conforms to the Pydantic model
-    return ShoppingResult(items=[ProductItem(**item) for item in all_items])
+    # Set a default value inside the function if not provided, and keep it in range
+    requested_rows = 10 if rows_per_query is None else rows_per_query
+    rows_per_query = min(max(requested_rows, 1), MAX_ROWS_PER_QUERY)
+    if rows_per_query != requested_rows:
+        logger.info("Clamped rows_per_query from %s to %s", requested_rows, rows_per_query)
+
+    # Overlapping queries would fire redundant concurrent requests; drop them up front
+    queries = _normalize_queries(queries)
+    if not queries:
+        return _EMPTY_RESULT
+
+    async def search(query):
+        try:
+            return await call_vector_search(
+                url=config.VECTOR_SEARCH_URL,
+                query=query,
+                rows=rows_per_query,
+            )
+        except Exception as e:
+            logger.error("Vector search failed for %r: %s", query, e)
+            return None
+
+    # Issue all queries at once and handle each as it returns; total latency is the
+    # slowest query, not the sum, and the first products reach the client early
+    tasks = [asyncio.ensure_future(search(query)) for query in queries]
+    index = {task: i for i, task in enumerate(tasks)}
+    results = [_PENDING] * len(tasks)
+    sink = _PRODUCT_SINK.get()
+    streamed_ids = set()
+    pending = set(tasks)
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = results[index[task]] = task.result()
+                if sink is not None and result:
+                    # Stream only validated ProductItem fields, never raw backend rows
+                    try:
+                        batch = _ITEMS_ADAPTER.validate_python(result["items"])
+                    except ValidationError as e:
+                        logger.error("Skipping invalid search results for streaming: %s", e)
+                        batch = []
+                    new_items = [item for item in batch if item.id not in streamed_ids]
+                    new_items = new_items[:max(MAX_ITEMS - len(streamed_ids), 0)]
+                    streamed_ids.update(item.id for item in new_items)
+                    if new_items:
+                        sink.put_nowait(("products", _ITEMS_ADAPTER.dump_python(new_items)))
+            # Stop once the queries answered so far, taken in order, already fill the cap
+            if len(_merge_items(results)) >= MAX_ITEMS:
+                break
+    finally:
+        # Don't leave searches running (and holding semaphore slots) past this call
+        for task in pending:
+            task.cancel()
+
+    # Built in query order so the same input yields the same items regardless of timing
+    all_items = _merge_items(results)
+
+    # Ensure the returned data conforms to the Pydantic model; the items are validated
+    # once by the adapter, so the wrapper itself is built without re-validation
+    return ShoppingResult.model_construct(items=_ITEMS_ADAPTER.validate_python(all_items))
 
 # --- Agents ---
 research_agent = Agent(
@@ -168,63 +376,191 @@ from starlette.responses import StreamingResponse
 
 # --- ADK Runner ---
 session_service = InMemorySessionService()
+runner = Runner(
+    app_name=config.APP_NAME,
+    agent=shop_agent,
+    session_service=session_service,
+)
+
+def _sse(event_type: str, data) -> bytes:
+    """
+    Encodes a {"type", "data"} message as a single SSE data frame.
+    """
+    return b"data: " + orjson.dumps({"type": event_type, "data": data}) + b"\n\n"
+
+# Static result frames, serialized once at import.
+_DECODE_ERROR_FRAME = _sse("result", {"intro_text": "Error decoding agent's JSON.", "products": []})
+_NOT_FOUND_FRAME = _sse("result", {"intro_text": "Sorry, I couldn't find anything.", "products": []})
+
+def _log_frame(message: str) -> bytes:
+    """
+    Builds a {"type": "log"} SSE frame around a pre-encoded message, skipping
+    the intermediate envelope dict.
+    """
+    return b'data: {"type":"log","data":' + orjson.dumps(message) + b'}\n\n'
 
-async def run_agent_and_stream_logs(query: str):
+def _event_summary(event) -> str:
+    """
+    Returns a short, cheap description of an ADK event for the log console.
+    Avoids str(event), which renders the whole event including tool payloads.
+    """
+    parts = event.content.parts if event.content else None
+    text = parts[0].text if parts and parts[0].text else None
+    return f"[{event.author}] {text[:200] if text else '<non-text>'}"
+
+def _first_json_object(text: str) -> Optional[str]:
+    """
+    Returns the first balanced {...} span in text, skipping braces inside JSON
+    strings, or None if there is none. Single pass, no backtracking.
+    """
+    start = text.find('{')
+    if start == -1:
+        return None
+    depth = 0
+    in_string = False
+    escaped = False
+    for i in range(start, len(text)):
+        ch = text[i]
+        if in_string:
+            if escaped:
+                escaped = False
+            elif ch == '\\':
+                escaped = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == '{':
+            depth += 1
+        elif ch == '}':
+            depth -= 1
+            if depth == 0:
+                return text[start:i + 1]
+    return None
+
+def _parse_response_json(text: str) -> Optional[dict]:
+    """
+    Parses the agent's JSON answer. The prompt asks for a bare JSON object, so
+    try that first and only fall back to scanning for the first {...} object.
+    Returns None when the text contains no complete object at all.
+    """
+    try:
+        parsed = orjson.loads(text)
+        if isinstance(parsed, dict):
+            return parsed
+    except orjson.JSONDecodeError:
+        pass
+    json_str = _first_json_object(text)
+    if json_str is None:
+        return None
+    return orjson.loads(json_str)
+
+async def run_agent_and_stream_logs(query: str, debug: bool = False):
     """
     Runs the agent and streams logs and the final result in SSE format.
     """
-    yield f"data: {json.dumps({'type': 'log', 'data': f'User Query: {query}'})}\n\n"
+    yield _log_frame(f"User Query: {query}")
 
     session = await session_service.create_session(
         app_name=config.APP_NAME,
         user_id=config.USER_ID,
     )
-    runner = Runner(
-        app_name=config.APP_NAME,
-        agent=shop_agent,
-        session_service=session_service,
-    )
     content = types.Content(role='user', parts=[types.Part(text=query)])
     
     final_response_text = None
 
-    try:
-        async for event in runner.run_async(user_id=config.USER_ID, session_id=session.id, new_message=content):
-            log_json = json.dumps({"type": "log", "data": str(event)})
-            yield f"data: {log_json}\n\n"
+    # Agent events and tool-side product batches share one queue, so products can be
+    # streamed while the agent is still inside a find_shopping_items call.
+    queue: asyncio.Queue = asyncio.Queue()
 
-            if event.is_final_response():
-                if event.content and event.content.parts:
-                    final_response_text = event.content.parts[0].text
-    except Exception as e:
-        error_log = json.dumps({"type": "log", "data": f"An error occurred: {e}"})
-        yield f"data: {error_log}\n\n"
+    async def pump_events():
+        try:
+            async for event in runner.run_async(user_id=config.USER_ID, session_id=session.id, new_message=content):
+                queue.put_nowait(("event", event))
+        except Exception as e:
+            queue.put_nowait(("error", e))
+        finally:
+            queue.put_nowait(("done", None))
+
+    # The task copies the current context, so the tool sees this request's queue
+    token = _PRODUCT_SINK.set(queue)
+    pump = asyncio.create_task(pump_events())
+    _PRODUCT_SINK.reset(token)
+
+    streamed_ids = set()
+    done = False
+    try:
+        while not done:
+            # Drain everything already queued and send it as one chunk
+            messages = [await queue.get()]
+            while not queue.empty():
+                messages.append(queue.get_nowait())
+
+            frames = []
+            for kind, value in messages:
+                if kind == "done":
+                    done = True
+                elif kind == "products":
+                    new_products = [item for item in value if item["id"] not in streamed_ids]
+                    streamed_ids.update(item["id"] for item in new_products)
+                    if new_products:
+                        frames.append(_sse("products", new_products))
+                elif kind == "error":
+                    frames.append(_log_frame(f"An error occurred: {value}"))
+                else:
+                    if debug:
+                        frames.append(_log_frame(_event_summary(value)))
+
+                    if value.is_final_response():
+                        if value.content and value.content.parts:
+                            final_response_text = value.content.parts[0].text
+            if frames:
+                yield b"".join(frames)
+    finally:
+        # Stop the agent if the client disconnected mid-stream
+        if not pump.done():
+            pump.cancel()
+        # Each /chat call is a standalone conversation; drop its session so the
+        # in-memory store does not grow with every request served
+        await session_service.delete_session(
+            app_name=config.APP_NAME,
+            user_id=config.USER_ID,
+            session_id=session.id,
+        )
 
     if final_response_text:
         try:
-            json_match = re.search(r'\{.*\}', final_response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group(0)
-                response_json = json.loads(json_str)
-                result_json = json.dumps({"type": "result", "data": response_json})
-                yield f"data: {result_json}\n\n"
+            response_json = _parse_response_json(final_response_text)
+            if response_json is not None:
+                yield _sse("result", response_json)
             else:
-                fallback_json = json.dumps({"type": "result", "data": {"intro_text": final_response_text, "products": []}})
-                yield f"data: {fallback_json}\n\n"
-        except json.JSONDecodeError:
-            error_json = json.dumps({"type": "result", "data": {"intro_text": "Error decoding agent's JSON.", "products": []}})
-            yield f"data: {error_json}\n\n"
+                yield _sse("result", {"intro_text": final_response_text, "products": []})
+        except orjson.JSONDecodeError:
+            yield _DECODE_ERROR_FRAME
     else:
-        not_found_json = json.dumps({"type": "result", "data": {"intro_text": "Sorry, I couldn't find anything.", "products": []}})
-        yield f"data: {not_found_json}\n\n"
+        yield _NOT_FOUND_FRAME
 
 
 # --- API Endpoint ---
 @app.get("/chat")
-async def chat(query: str):
-    if not config.GOOGLE_API_KEY or config.GOOGLE_API_KEY == "YOUR_API_KEY":
+async def chat(query: str, debug: bool = DEBUG_EVENTS):
+    if not _API_KEY_CONFIGURED:
         return {"error": "GOOGLE_API_KEY environment variable not set."}
-    os.environ["GOOGLE_API_KEY"] = config.GOOGLE_API_KEY
 
-    return StreamingResponse(run_agent_and_stream_logs(query), media_type="text/event-stream")
+    return StreamingResponse(run_agent_and_stream_logs(query, debug), media_type="text/event-stream")
 
+
+if __name__ == "__main__":
+    import uvicorn
+
+    limit_concurrency = os.environ.get("UVICORN_LIMIT_CONCURRENCY")
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=8000,
+        # "auto" picks uvloop where it is installed (not on Windows), asyncio otherwise
+        loop="auto",
+        http="httptools",
+        workers=int(os.environ.get("UVICORN_WORKERS", max(2, os.cpu_count() or 1))),
+        limit_concurrency=int(limit_concurrency) if limit_concurrency else None,
+    )
@@ -0,0 +1,17 @@
+from main import _normalize_queries
+
+
+def test_normalize_queries_dedupes_and_collapses_whitespace():
+    assert _normalize_queries(["LEGO  sets", "lego sets", " ", "Mugs"]) == ["lego sets", "mugs"]
+
+
+def test_normalize_queries_drops_word_level_sub_queries():
+    assert _normalize_queries(["mugs", "coffee mugs", "coffee"]) == ["coffee mugs"]
+    assert _normalize_queries(["lego sets", "lego building sets"]) == ["lego sets", "lego building sets"]
+
+
+def test_normalize_queries_keeps_character_level_overlaps():
+    assert _normalize_queries(["cap", "cape", "hat", "chat"]) == ["cap", "cape", "hat", "chat"]
+    assert _normalize_queries(["art", "party supplies", "pen", "pendant necklace", "ring", "earrings"]) == [
+        "art", "party supplies", "pen", "pendant necklace", "ring", "earrings",
+    ]
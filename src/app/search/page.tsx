@@ -20,6 +20,7 @@ export default function SearchPage() {
   } = useSpeechRecognition();
   const [inputValue, setInputValue] = useState('');
   const [logs, setLogs] = useState<string[]>([]);
+  const [pendingProducts, setPendingProducts] = useState<Product[]>([]);
   const [showLogs, setShowLogs] = useState(false);
 
   useEffect(() => {
@@ -38,16 +39,25 @@ export default function SearchPage() {
       setInputValue('');
       resetTranscript();
       setLogs([]); // Clear previous logs
+      setPendingProducts([]);
 
-      const eventSource = new EventSource(`http://localhost:8000/chat?query=${encodeURIComponent(query)}`);
+      // Ask for per-event server logs while the log console is open; otherwise
+      // leave the server default (ADK_DEBUG_EVENTS) in charge
+      const debugParam = showLogs ? '&debug=true' : '';
+      const eventSource = new EventSource(`http://localhost:8000/chat?query=${encodeURIComponent(query)}${debugParam}`);
 
       eventSource.onmessage = (event) => {
         const parsedData = JSON.parse(event.data);
 
         if (parsedData.type === 'log') {
           setLogs(prevLogs => [...prevLogs, parsedData.data]);
+        } else if (parsedData.type === 'products') {
+          // Raw search hits, streamed while the agent is still composing its answer
+          setPendingProducts(prevProducts => [...prevProducts, ...parsedData.data]);
         } else if (parsedData.type === 'result') {
           const { intro_text, products } = parsedData.data;
+          // The agent's curated list replaces the streamed preview
+          setPendingProducts([]);
           // Add the bot's introductory message to the chat
           setMessages(prevMessages => [...prevMessages, { text: intro_text, sender: 'bot', products }]);
           eventSource.close();
@@ -57,12 +67,14 @@ export default function SearchPage() {
       eventSource.onerror = (err) => {
         console.error("EventSource failed:", err);
         setLogs(prevLogs => [...prevLogs, "Error receiving stream from server."]);
+        // Without a result, the streamed preview is not an answer
+        setPendingProducts([]);
         eventSource.close();
       };
     }
   };
 
-  const allProducts = messages.flatMap(msg => msg.products || []);
+  const allProducts = [...messages.flatMap(msg => msg.products || []), ...pendingProducts];
 
   return (
     <div className="container-fluid vh-100 d-flex flex-column" style={{ backgroundColor: '#121212', color: '#e0e0e0' }}>